@@ -1,15 +1,19 @@
 import pygame as pg
-from numba import njit
+from numba import njit, prange
 import numpy as np
 import math
-from threading import Thread
-import queue
+try:
+    import moderngl
+except ImportError:  # Optional: without it the Numba raycaster is used
+    moderngl = None
 
 # Configuration constants
 CHUNK_SIZE = 10
 LOAD_DISTANCE = 1
 DRAW_DISTANCE = 5000
 INFINITE_MAP = False
+USE_GPU = False  # Raycast in a fragment shader when moderngl and a GL 3.3 context are available
+HALF_RES_RAYS = False  # Start with one ray per two screen columns (toggle with R)
 # Sky breathing effect configuration
 SKY_AMPLITUDE = 10      # Maximum vertical shift (in pixels) for the sky
 SKY_FREQUENCY = 0.0005  # Oscillation frequency for the sky
@@ -36,9 +40,52 @@ WORLD_SCALE = 1 # Default scale: 1.0 = human size, <1 = giant world, >1 = tiny w
 WORLD_SCALE_MIN = 1  # Minimum scale (very large world)
 WORLD_SCALE_MAX = 5 # Maximum scale (very small world)
 WORLD_SCALE_STEP = 0.1 # How much to change scale per key press
+
+# Empty-space skipping over a max-height pyramid
+HEIGHT_MIP_LEVELS = 6   # Pyramid levels (tiles up to 2^(n-1) texels wide)
+SKIP_MIN_LEVEL = 2      # Smallest tile level tested (2x2 tiles rarely pay for the test)
+SKIP_MARGIN = 16        # Retry skipping once a sample lands this many pixels below y_buffer
+
+# Distance LOD for far terrain samples
+LOD_LEVELS = 3          # Number of map LODs (LOD0 = full resolution)
+LOD_DISTANCE = 512      # Depth where LOD1 starts; each further LOD starts at twice the depth
 # Load base height map and color map
-base_height_map = pg.surfarray.array3d(pg.image.load('D1.png'))
-base_color_map = pg.surfarray.array3d(pg.image.load('C1W.png'))
+# Heights keep only the first channel as a dense 2D array; colours stay (W, H, 3)
+base_height_map = np.ascontiguousarray(pg.surfarray.array3d(pg.image.load('D1.png'))[:, :, 0], dtype=np.uint8)
+base_color_map = np.ascontiguousarray(pg.surfarray.array3d(pg.image.load('C1W.png')), dtype=np.uint8)
+
+# ------------------------------------------------------------
+# Map Pyramids
+# ------------------------------------------------------------
+def build_mips(layer, levels, reduce_tiles):
+    # Level n covers 2^n x 2^n texels of the map, built by reducing each 2x2
+    # tile of level n-1; all levels are flattened into one array (keeping any
+    # channel axis) with a table of per-level start offsets
+    mips = [layer]
+    for _ in range(1, levels):
+        mip = mips[-1]
+        pad = ((0, mip.shape[0] % 2), (0, mip.shape[1] % 2)) + ((0, 0),) * (mip.ndim - 2)
+        mip = np.pad(mip, pad, mode='edge')
+        mips.append(reduce_tiles(np.stack([mip[::2, ::2], mip[1::2, ::2], mip[::2, 1::2], mip[1::2, 1::2]])))
+    offsets = np.cumsum([0] + [mip.shape[0] * mip.shape[1] for mip in mips[:-1]]).astype(np.int64)
+    flat = np.concatenate([mip.reshape((-1,) + mip.shape[2:]) for mip in mips])
+    return np.ascontiguousarray(flat), offsets
+
+def max_height(tiles):
+    return tiles.max(axis=0)
+
+def dense_height(tiles):
+    # A coarse column reaches the height at least two of its four children reach
+    return np.sort(tiles, axis=0)[2]
+
+def average_color(tiles):
+    return ((tiles.sum(axis=0, dtype=np.uint16) + 2) // 4).astype(np.uint8)
+
+# Max pyramid for conservative empty-space skipping
+height_mips, height_mip_offsets = build_mips(base_height_map, HEIGHT_MIP_LEVELS, max_height)
+# Rendering LODs for far samples
+height_lods, lod_offsets = build_mips(base_height_map, LOD_LEVELS, dense_height)
+color_lods, _ = build_mips(base_color_map, LOD_LEVELS, average_color)
 
 # ------------------------------------------------------------
 # Chunk and Chunk Manager Functions
@@ -46,22 +93,10 @@ base_color_map = pg.surfarray.array3d(pg.image.load('C1W.png'))
 def create_chunk(x, y):
     return {'x': x, 'y': y, 'heightmap': None, 'colormap': None}
 
-def chunk_loader(cm):
-    while True:
-        chunk_coord = cm['load_queue'].get()
-        if chunk_coord not in cm['loaded_chunks']:
-            cm['loaded_chunks'][chunk_coord] = create_chunk(*chunk_coord)
-        cm['load_queue'].task_done()
-
 def init_chunk_manager():
     cm = {}
     cm['loaded_chunks'] = {}
     cm['active_area'] = (0, 0)
-    cm['load_queue'] = queue.Queue()
-    worker = Thread(target=chunk_loader, args=(cm,))
-    worker.daemon = True
-    worker.start()
-    cm['worker'] = worker
     return cm
 
 def get_chunk(world_x, world_y):
@@ -81,7 +116,9 @@ def load_chunks_around(player_pos, cm):
             del cm['loaded_chunks'][chunk]
     for chunk_coord in chunks_to_load:
         if chunk_coord not in cm['loaded_chunks']:
-            cm['load_queue'].put(chunk_coord)
+            # Chunks are cheap placeholders, so insert them inline; real loading
+            # should go to a process pool or a nogil worker, not a GIL-bound thread
+            cm['loaded_chunks'][chunk_coord] = create_chunk(*chunk_coord)
 
 # ------------------------------------------------------------
 # Numba-accelerated Functions
@@ -102,43 +139,130 @@ def optimized_collision_check(pos, height_map):
             y = 0
         elif y >= height_map.shape[1]:
             y = height_map.shape[1] - 1
-    return height_map[x, y][0]
-
-@njit(fastmath=True)
-def ray_casting(screen_array, player_pos, player_angle, player_height, player_pitch,
-                screen_width, screen_height, delta_angle, ray_distance, h_fov, scale_height, world_scale):
-    y_buffer = np.full(screen_width, screen_height)
-    map_width = base_height_map.shape[0]
-    map_height = base_height_map.shape[1]
-    ray_angle = player_angle - h_fov
-    for num_ray in range(screen_width):
+    return height_map[x, y]
+
+@njit('uint8[:,:,:](uint8[:,:,:], uint8[:,:,::1], int64, int64, int64, int64, uint8[::1], int64[::1], uint8[::1], uint8[:,::1], int64[::1], '
+      'float64[:], float64, float64, float64, int64, int64, float64[::1], float64[::1], float64[::1], int64, int64, float64)',
+      cache=True, fastmath=True, parallel=True, boundscheck=False)
+def ray_casting(screen_array, sky_array, sky_offset, sky_step, map_width, map_height, height_mips, mip_offsets,
+                height_lods, color_lods, lod_offsets, player_pos, player_angle, player_height, player_pitch, screen_width, screen_height,
+                cos_off, sin_off, inv_depths, ray_distance, scale_height, world_scale):
+    top_level = mip_offsets.shape[0] - 1
+    top_lod = lod_offsets.shape[0] - 1
+    terrain_top = height_mips[mip_offsets[top_level]:].max() * world_scale
+    cos_p = math.cos(player_angle)
+    sin_p = math.sin(player_angle)
+    sky_width = sky_array.shape[0]
+    # Rays are independent, so each column is rendered on its own thread
+    for num_ray in prange(screen_width):
+        y_buffer = screen_height
         first_contact = False
-        sin_a = math.sin(ray_angle)
-        cos_a = math.cos(ray_angle)
-        for depth in range(1, ray_distance):
+        first_row = screen_height
+        # Rotate the column's fixed offset by the view angle (angle addition),
+        # so no trig is evaluated per ray
+        cos_a = cos_p * cos_off[num_ray] - sin_p * sin_off[num_ray]
+        sin_a = sin_p * cos_off[num_ray] + cos_p * sin_off[num_ray]
+        # Fisheye correction is constant along the ray: cos(player_angle - ray_angle)
+        inv_corr = 1.0 / cos_off[num_ray]
+        # Advance one texel along the ray's major axis per step (line DDA),
+        # so consecutive samples never land on the same map cell
+        step = 1.0 / max(abs(cos_a), abs(sin_a))
+        inv_cos_a = 1.0 / cos_a if cos_a != 0 else math.inf
+        inv_sin_a = 1.0 / sin_a if sin_a != 0 else math.inf
+        num_steps = int((ray_distance - 1) / step)
+        projection = inv_corr * scale_height
+        # Lowest row any remaining terrain can still reach: the tallest voxel
+        # at the end of the ray when the camera is above all terrain, else
+        # the top of the screen. Once y_buffer is there the column is done.
+        stop_row = 0
+        if player_height > terrain_top:
+            stop_row = max(0, int((player_height - terrain_top) * projection /
+                                  max(1.0, num_steps * step) + player_pitch))
+        # Start fine for the first contact, then walk the max-height pyramid
+        # whenever the ray is well below what is drawn: skip whole tiles whose
+        # tallest voxel cannot rise above y_buffer, otherwise descend a level
+        # and fall back to single texels for the rest of the smallest tile
+        level = 0
+        fine_until = 0.0
+        # Fine samples read coarser map LODs with distance
+        lod = 0
+        lod_depth = LOD_DISTANCE
+        lod_rows = map_height
+        num_step = 1
+        while num_step <= num_steps:
+            depth = num_step * step
+            ray_x = player_pos[0] + depth * cos_a
+            ray_y = player_pos[1] + depth * sin_a
             if INFINITE_MAP:
-                x = int(player_pos[0] + depth * cos_a) % map_width
-                y = int(player_pos[1] + depth * sin_a) % map_height
+                x = int(ray_x) % map_width
+                y = int(ray_y) % map_height
             else:
-                x = int(player_pos[0] + depth * cos_a)
-                y = int(player_pos[1] + depth * sin_a)
+                x = int(ray_x)
+                y = int(ray_y)
                 if x < 0 or x >= map_width or y < 0 or y >= map_height:
                     break
-            depth_corr = depth * math.cos(player_angle - ray_angle)
+            if level > 0:
+                tile_size = 1 << level
+                tile_rows = (map_height + tile_size - 1) >> level
+                tile_height = height_mips[mip_offsets[level] + (x >> level) * tile_rows + (y >> level)]
+                # Distance along the ray to where it leaves the current tile
+                tile_x = int(ray_x) - (x & (tile_size - 1))
+                tile_y = int(ray_y) - (y & (tile_size - 1))
+                if cos_a > 0:
+                    tile_x += tile_size
+                if sin_a > 0:
+                    tile_y += tile_size
+                exit_x = (tile_x - ray_x) * inv_cos_a if cos_a != 0 else math.inf
+                exit_y = (tile_y - ray_y) * inv_sin_a if sin_a != 0 else math.inf
+                exit_depth = depth + min(exit_x, exit_y)
+                # Projection is monotonic in depth, so the tile's highest
+                # point on screen is at one of its two ends
+                relative_height = (player_height - tile_height * world_scale) * projection
+                top_on_screen = int(min(relative_height * inv_depths[num_step - 1] / step,
+                                        relative_height / exit_depth) + player_pitch)
+                if top_on_screen > y_buffer:
+                    num_step = max(num_step + 1, int(math.ceil(exit_depth / step)))
+                    if level < top_level:
+                        level += 1
+                    continue
+                if level == SKIP_MIN_LEVEL:
+                    fine_until = exit_depth
+                    level = 0
+                else:
+                    level -= 1
+                continue
+            # A skip can jump past several LOD boundaries at once
+            while depth >= lod_depth and lod < top_lod:
+                lod += 1
+                lod_depth *= 2
+                lod_rows = (map_height + (1 << lod) - 1) >> lod
+            texel = lod_offsets[lod] + (x >> lod) * lod_rows + (y >> lod)
             # Scale terrain height and player height by world_scale
-            scaled_height = base_height_map[x, y][0] * world_scale
-            height_on_screen = int((player_height - scaled_height) /
-                                 depth_corr * scale_height + player_pitch)
+            scaled_height = height_lods[texel] * world_scale
+            height_on_screen = int((player_height - scaled_height) *
+                                   inv_depths[num_step - 1] * (projection / step) + player_pitch)
             if not first_contact:
-                y_buffer[num_ray] = min(height_on_screen, screen_height)
+                y_buffer = min(height_on_screen, screen_height)
+                first_row = max(y_buffer, 0)
                 first_contact = True
             if height_on_screen < 0:
                 height_on_screen = 0
-            if height_on_screen < y_buffer[num_ray]:
-                for screen_y in range(height_on_screen, y_buffer[num_ray]):
-                    screen_array[num_ray, screen_y] = base_color_map[x, y]
-                y_buffer[num_ray] = height_on_screen
-        ray_angle += delta_angle
+            if height_on_screen < y_buffer:
+                screen_array[num_ray, height_on_screen:y_buffer, :] = color_lods[texel, :]
+                y_buffer = height_on_screen
+            if y_buffer <= stop_row:
+                break
+            num_step += 1
+            if (top_level >= SKIP_MIN_LEVEL and height_on_screen >= y_buffer + SKIP_MARGIN
+                    and num_step * step >= fine_until):
+                level = SKIP_MIN_LEVEL
+        # Sky only goes where no terrain was drawn: above the last span and
+        # below the first contact, which is never painted
+        sky_x = (sky_offset + num_ray * sky_step) % sky_width
+        if y_buffer > 0:
+            screen_array[num_ray, :y_buffer, :] = sky_array[sky_x, :y_buffer, :]
+        if first_row < screen_height:
+            screen_array[num_ray, first_row:, :] = sky_array[sky_x, first_row:screen_height, :]
     return screen_array
 
 def create_player():
@@ -162,10 +286,11 @@ def create_player():
         'jump_force': 12,  # Jump power
     }
 
-def update_player(player, mouse_rel, draw_distance, cm, dt, world_scale):  # Added world_scale
-    keys = pg.key.get_pressed()
+def update_player(player, keys, mouse_rel, current_time, draw_distance, cm, dt, world_scale):  # Added world_scale
     mouse_buttons = pg.mouse.get_pressed()
-    current_time = pg.time.get_ticks()
+    # Frame-rate independent damping, shared by every axis below
+    damping = math.pow(DAMPING, dt * 60)
+    pitch_damping = math.pow(PITCH_DAMPING, dt * 60)
 
     # --- Mouse Look ---
     player['angle'] += mouse_rel[0] * player['angle_vel'] * dt * 60
@@ -188,7 +313,7 @@ def update_player(player, mouse_rel, draw_distance, cm, dt, world_scale):  # Add
     # Adjust movement speed based on world_scale (inverse scaling)
     scale_factor = 1.0 / world_scale
     player['vel'] += input_vec * ACCELERATION * dt * 60 * scale_factor
-    player['vel'] *= math.pow(DAMPING, dt * 60)
+    player['vel'] *= damping
     move_dir = np.array([
         math.cos(player['angle']) * player['vel'][1] - math.sin(player['angle']) * player['vel'][0],
         math.sin(player['angle']) * player['vel'][1] + math.cos(player['angle']) * player['vel'][0]
@@ -219,7 +344,7 @@ def update_player(player, mouse_rel, draw_distance, cm, dt, world_scale):  # Add
     if keys[pg.K_LSHIFT] or keys[pg.K_RSHIFT]:
         vertical_input -= 1
     player['v_vel'] += vertical_input * ACCELERATION * dt * 60 * scale_factor
-    player['v_vel'] *= math.pow(DAMPING, dt * 60)
+    player['v_vel'] *= damping
     player['height'] += player['v_vel'] * dt * 60 * scale_factor
 
     # --- Terrain Collision ---
@@ -235,7 +360,7 @@ def update_player(player, mouse_rel, draw_distance, cm, dt, world_scale):  # Add
     if keys[pg.K_DOWN]:
         pitch_input += 1
     player['pitch_vel'] += pitch_input * PITCH_ACCEL * dt * 60
-    player['pitch_vel'] *= math.pow(PITCH_DAMPING, dt * 60)
+    player['pitch_vel'] *= pitch_damping
     player['pitch'] += player['pitch_vel'] * dt * 60
     player['pitch'] = max(min(player['pitch'], PITCH_MAX), PITCH_MIN)
 
@@ -287,75 +412,234 @@ def create_voxel_render(width, height):
     vr['delta_angle'] = vr['fov'] / width
     vr['ray_distance'] = 1000
     vr['scale_height'] = 920
+    # Per-column ray offsets from the view direction never change
+    column_angles = -vr['h_fov'] + np.arange(vr['num_rays']) * vr['delta_angle']
+    vr['cos_off'] = np.cos(column_angles)
+    vr['sin_off'] = np.sin(column_angles)
+    # Half-resolution mode casts one ray through the middle of each column pair
+    vr['half_res'] = HALF_RES_RAYS
+    low_angles = -vr['h_fov'] + (np.arange(width // 2) * 2 + 0.5) * vr['delta_angle']
+    vr['low_cos_off'] = np.cos(low_angles)
+    vr['low_sin_off'] = np.sin(low_angles)
+    # Reciprocal depths 1..n-1, shared by every frame (grown if the draw distance exceeds it)
+    vr['inv_depths'] = 1.0 / np.arange(1, DRAW_DISTANCE, dtype=np.float64)
 
     # Increase sky dimensions to avoid duplicate suns
     sky_width = int(width * 1.5)
     sky_height = int(height * 2)
 
-    # 1) Create the sky gradient surface
-    sky_surface = pg.Surface((sky_width, sky_height), pg.SRCALPHA)
-    for y in range(sky_height):
-        factor = 1 - (y / sky_height)
-        sky_color = (
-            int(135 * factor),
-            int(206 * factor),
-            int(235 * factor)
-        )
-        pg.draw.line(sky_surface, sky_color, (0, y), (sky_width, y))
+    # 1) Sky gradient, one colour per row (arrays are indexed [x, y] like surfarray)
+    factors = 1 - np.arange(sky_height) / sky_height
+    gradient = (np.array([135, 206, 235]) * factors[:, None]).astype(np.uint8)
+    sky = np.ascontiguousarray(np.broadcast_to(gradient, (sky_width, sky_height, 3)))
 
-    # 2) Create a separate sun surface with alpha
+    # 2) Sun alpha: opaque core, glow fading linearly to 0 at sun_glow_radius
     sun_glow_radius = 80
     sun_radius = 50
     sun_size = sun_glow_radius * 2
-    sun_surface = pg.Surface((sun_size, sun_size), pg.SRCALPHA)
-    sun_surface.fill((0, 0, 0, 0))  # fully transparent background
-
-    # 3) Radial gradient: center = bright yellow, outer = alpha=0
-    center = (sun_glow_radius, sun_glow_radius)
-    for y in range(sun_size):
-        for x in range(sun_size):
-            dist = math.hypot(x - center[0], y - center[1])
-            if dist <= sun_radius:
-                # fully opaque sun core
-                sun_surface.set_at((x, y), (255, 255, 0, 255))
-            elif dist <= sun_glow_radius:
-                # glow zone
-                glow_factor = 1 - (dist - sun_radius) / (sun_glow_radius - sun_radius)
-                # alpha goes from 255 near sun_radius to 0 at sun_glow_radius
-                alpha = int(255 * glow_factor)
-                # color is always yellow, just less alpha
-                sun_surface.set_at((x, y), (255, 255, 0, alpha))
-            else:
-                # outside glow
-                sun_surface.set_at((x, y), (0, 0, 0, 0))
+    x, y = np.ogrid[:sun_size, :sun_size]
+    dist = np.hypot(x - sun_glow_radius, y - sun_glow_radius)
+    glow_factor = 1 - (dist - sun_radius) / (sun_glow_radius - sun_radius)
+    alpha = np.where(dist <= sun_radius, 255,
+                     np.where(dist <= sun_glow_radius, (255 * glow_factor).astype(int), 0))
 
-    # 4) Blit sun onto the sky with normal alpha blend (no special_flags)
+    # 3) Alpha-blend the yellow sun onto the sky (same integer blend as Surface.blit)
     sun_x = sky_width // 2
     sun_y = sky_height // 6
-    sky_surface.blit(sun_surface, (sun_x - sun_glow_radius, sun_y - sun_glow_radius))
-
-    # Store pre-rendered sky
-    vr['sky_image'] = sky_surface
-    vr['screen_array'] = np.full((width, height, 3), (0, 0, 0))
+    left, top = sun_x - sun_glow_radius, sun_y - sun_glow_radius
+    patch = sky[left:left + sun_size, top:top + sun_size].astype(int)
+    sun_color = np.array([255, 255, 0])
+    patch += ((sun_color - patch) * alpha[:, :, None] + sun_color) >> 8
+    sky[left:left + sun_size, top:top + sun_size] = patch
+
+    # Store pre-rendered sky as an array so frames never touch a Surface
+    vr['sky_array'] = sky
+    # Contiguous frame for the GPU read-back (the CPU path renders into the display)
+    vr['screen_array'] = np.zeros((width, height, 3), dtype=np.uint8)
+    vr['gpu'] = create_gpu_raycaster(vr['sky_array'], width, height) if USE_GPU else None
     return vr
 
-def update_voxel_render(vr, player, width, height, draw_distance, current_time, world_scale):  # Added world_scale
+def update_voxel_render(vr, player, width, height, draw_distance, current_time, world_scale, pixels, pixels2d):  # Added world_scale
     vr['ray_distance'] = int(draw_distance)
-    sky_x_offset = int((player['angle'] / (2 * math.pi)) * width) % vr['sky_image'].get_width()
-    screen_surface = pg.Surface((width, height))
-    screen_surface.blit(vr['sky_image'], (-sky_x_offset, 0))
-    screen_surface.blit(vr['sky_image'], (vr['sky_image'].get_width() - sky_x_offset, 0))
-    vr['screen_array'] = pg.surfarray.array3d(screen_surface)
+    if vr['ray_distance'] - 1 > vr['inv_depths'].shape[0]:
+        vr['inv_depths'] = 1.0 / np.arange(1, vr['ray_distance'], dtype=np.float64)
+    sky_width = vr['sky_array'].shape[0]
+    sky_x_offset = int((player['angle'] / (2 * math.pi)) * width) % sky_width
     breath_offset = BREATH_AMPLITUDE * math.sin(current_time * BREATH_FREQUENCY)
     effective_height = player['height'] + breath_offset
-    vr['screen_array'] = ray_casting(
-        vr['screen_array'], player['pos'], player['angle'], effective_height,
-        player['pitch'], width, height, vr['delta_angle'], vr['ray_distance'],
-        vr['h_fov'], vr['scale_height'], world_scale  # Pass world_scale
+    if vr['gpu'] is not None:
+        gpu_ray_casting(
+            vr['gpu'], vr['screen_array'], player['pos'], player['angle'], effective_height,
+            player['pitch'], vr['delta_angle'], vr['ray_distance'], vr['h_fov'], vr['scale_height'],
+            world_scale, sky_x_offset
+        )
+        pixels[:] = vr['screen_array']
+        return
+    if vr['half_res']:
+        # Rays land in the even screen columns and are copied to the odd ones
+        pairs = width // 2
+        target, cos_off, sin_off, column_step = pixels[0:pairs * 2:2], vr['low_cos_off'], vr['low_sin_off'], 2
+    else:
+        target, cos_off, sin_off, column_step = pixels, vr['cos_off'], vr['sin_off'], 1
+    ray_casting(
+        target, vr['sky_array'], sky_x_offset, column_step, base_height_map.shape[0], base_height_map.shape[1],
+        height_mips, height_mip_offsets, height_lods, color_lods, lod_offsets,
+        player['pos'], player['angle'], effective_height,
+        player['pitch'], target.shape[0], height, cos_off, sin_off, vr['inv_depths'], vr['ray_distance'],
+        vr['scale_height'], world_scale  # Pass world_scale
     )
+    if vr['half_res']:
+        if pixels2d is not None:
+            # Whole 32-bit pixels copy far faster than strided RGB bytes
+            pixels2d[1:pairs * 2:2] = pixels2d[0:pairs * 2:2]
+        else:
+            pixels[1:pairs * 2:2] = pixels[0:pairs * 2:2]
+        if width % 2:
+            pixels[-1] = pixels[-2]
 
-def draw_voxel_render(vr, screen):
-    pg.surfarray.blit_array(screen, vr['screen_array'])
+# ------------------------------------------------------------
+# GPU Raycaster (optional, requires moderngl)
+# ------------------------------------------------------------
+GPU_VERTEX_SHADER = '''
+#version 330
+in vec2 in_position;
+void main() {
+    gl_Position = vec4(in_position, 0.0, 1.0);
+}
+'''
+
+# Same march as ray_casting, evaluated per pixel: each fragment walks its
+# column's ray until the span covering its row is found. The framebuffer is
+# laid out height x width so that gl_FragCoord.x is the screen row and
+# gl_FragCoord.y the ray, which makes the readback match surfarray's (x, y) order.
+# Every fragment re-marches its column and there are no distance LODs, so far
+# terrain differs from the CPU image and the cost grows with screen height.
+GPU_FRAGMENT_SHADER = '''
+#version 330
+#define INFINITE_MAP %d
+uniform sampler2D height_map;
+uniform sampler2D color_map;
+uniform sampler2D sky;
+uniform ivec2 map_size;
+uniform int screen_height;
+uniform int sky_width;
+uniform int sky_offset;
+uniform vec2 player_pos;
+uniform float player_angle;
+uniform float player_height;
+uniform float player_pitch;
+uniform float delta_angle;
+uniform int ray_distance;
+uniform float h_fov;
+uniform float scale_height;
+uniform float world_scale;
+out vec3 frag_color;
+
+void main() {
+    int screen_y = int(gl_FragCoord.x);
+    int num_ray = int(gl_FragCoord.y);
+    float ray_angle = player_angle - h_fov + num_ray * delta_angle;
+    vec2 direction = vec2(cos(ray_angle), sin(ray_angle));
+    float ray_step = 1.0 / max(abs(direction.x), abs(direction.y));
+    float projection = scale_height / cos(player_angle - ray_angle);
+    int num_steps = int((ray_distance - 1) / ray_step);
+    int y_buffer = screen_height;
+    for (int num_step = 1; num_step <= num_steps; num_step++) {
+        float depth = num_step * ray_step;
+        ivec2 cell = ivec2(player_pos + depth * direction);
+#if INFINITE_MAP
+        cell = (cell %% map_size + map_size) %% map_size;
+#else
+        if (any(lessThan(cell, ivec2(0))) || any(greaterThanEqual(cell, map_size))) {
+            break;
+        }
+#endif
+        float scaled_height = texelFetch(height_map, cell.yx, 0).r * 255.0 * world_scale;
+        int height_on_screen = int((player_height - scaled_height) * projection / depth + player_pitch);
+        if (num_step == 1) {
+            y_buffer = min(height_on_screen, screen_height);
+        }
+        height_on_screen = max(height_on_screen, 0);
+        if (height_on_screen < y_buffer) {
+            if (screen_y >= height_on_screen) {
+                frag_color = texelFetch(color_map, cell.yx, 0).rgb;
+                return;
+            }
+            y_buffer = height_on_screen;
+        }
+        if (screen_y >= y_buffer) {
+            break;
+        }
+    }
+    frag_color = texelFetch(sky, ivec2(screen_y, (num_ray + sky_offset) %% sky_width), 0).rgb;
+}
+''' % INFINITE_MAP
+
+# Software rasterizers are far slower than the Numba raycaster
+SOFTWARE_RENDERERS = ('llvmpipe', 'softpipe', 'swiftshader', 'software')
+
+def create_gpu_context():
+    # Prefer the platform's default context, then a headless EGL one
+    for settings in ({}, {'backend': 'egl'}):
+        try:
+            ctx = moderngl.create_standalone_context(**settings)
+        except Exception:
+            continue
+        renderer = ctx.info['GL_RENDERER'].lower()
+        if any(name in renderer for name in SOFTWARE_RENDERERS):
+            ctx.release()
+            continue
+        return ctx
+    return None
+
+def create_gpu_raycaster(sky_array, width, height):
+    if moderngl is None:
+        return None
+    ctx = create_gpu_context()
+    if ctx is None:
+        return None
+    gpu = {'ctx': ctx}
+    # Drivers may still reject the shader or the texture allocations
+    try:
+        gpu['program'] = ctx.program(vertex_shader=GPU_VERTEX_SHADER, fragment_shader=GPU_FRAGMENT_SHADER)
+        quad = ctx.buffer(np.array([-1, -1, 1, -1, -1, 1, 1, 1], dtype='f4').tobytes())
+        gpu['vao'] = ctx.vertex_array(gpu['program'], [(quad, '2f', 'in_position')])
+        # Textures are indexed (y, x) since the maps are stored x-major
+        map_width, map_height = base_height_map.shape
+        gpu['height_map'] = ctx.texture((map_height, map_width), 1, base_height_map.tobytes(), alignment=1)
+        gpu['color_map'] = ctx.texture((map_height, map_width), 3, base_color_map.tobytes(), alignment=1)
+        sky = np.ascontiguousarray(sky_array)
+        gpu['sky'] = ctx.texture((sky.shape[1], sky.shape[0]), 3, sky.tobytes(), alignment=1)
+        gpu['fbo'] = ctx.simple_framebuffer((height, width), components=3)
+        program = gpu['program']
+        for unit, name in enumerate(('height_map', 'color_map', 'sky')):
+            gpu[name].filter = (moderngl.NEAREST, moderngl.NEAREST)
+            gpu[name].use(unit)
+            program[name].value = unit
+        program['map_size'].value = (map_width, map_height)
+        program['screen_height'].value = height
+        program['sky_width'].value = sky.shape[0]
+    except moderngl.Error:
+        ctx.release()
+        return None
+    return gpu
+
+def gpu_ray_casting(gpu, screen_array, player_pos, player_angle, player_height, player_pitch,
+                    delta_angle, ray_distance, h_fov, scale_height, world_scale, sky_offset):
+    program = gpu['program']
+    program['player_pos'].value = (player_pos[0], player_pos[1])
+    program['player_angle'].value = player_angle
+    program['player_height'].value = player_height
+    program['player_pitch'].value = player_pitch
+    program['delta_angle'].value = delta_angle
+    program['ray_distance'].value = ray_distance
+    program['h_fov'].value = h_fov
+    program['scale_height'].value = scale_height
+    program['world_scale'].value = world_scale
+    program['sky_offset'].value = sky_offset
+    gpu['fbo'].use()
+    gpu['vao'].render(moderngl.TRIANGLE_STRIP)
+    gpu['fbo'].read_into(screen_array, components=3, alignment=1)
 
 # ------------------------------------------------------------
 # Application Functions
@@ -369,6 +653,11 @@ def init_app():
     app['player'] = create_player()
     app['chunk_manager'] = init_chunk_manager()
     app['voxel_render'] = create_voxel_render(app['width'], app['height'])
+    # Frames are rendered straight into the display surface, which stays
+    # locked by these views until they are released on quit
+    app['pixels'] = pg.surfarray.pixels3d(app['screen'])
+    # The packed view is only available on 32-bit surfaces
+    app['pixels2d'] = pg.surfarray.pixels2d(app['screen']) if app['screen'].get_bytesize() == 4 else None
     app['dt'] = 0.0
     app['world_scale'] = WORLD_SCALE  # Add world scale to app
     pg.mouse.set_visible(False)
@@ -381,10 +670,16 @@ def run_app():
     while True:
         for event in pg.event.get():
             if event.type == pg.QUIT or (event.type == pg.KEYDOWN and event.key == pg.K_ESCAPE):
+                del app['pixels'], app['pixels2d']
                 pg.quit()
                 return
+            # Half resolution only applies to the CPU raycaster
+            if event.type == pg.KEYDOWN and event.key == pg.K_r and app['voxel_render']['gpu'] is None:
+                app['voxel_render']['half_res'] = not app['voxel_render']['half_res']
         app['dt'] = app['clock'].tick(240) / 1000.0
-        update_app(app)
+        # Poll the keyboard once per frame and share it with every consumer
+        keys = pg.key.get_pressed()
+        update_app(app, keys)
         draw_app(app)
         pg.display.set_caption(
             f'FPS: {app["clock"].get_fps():.1f} | '
@@ -393,27 +688,27 @@ def run_app():
             f'Scale: {app["world_scale"]:.1f}'
         )
 
-def update_app(app):
+def update_app(app, keys):
     mouse_rel = pg.mouse.get_rel()
-    pressed_key = pg.key.get_pressed()
     
-    if pressed_key[pg.K_PAGEUP]:
+    if keys[pg.K_PAGEUP]:
         app['draw_distance'] = min(3000, app['draw_distance'] + 50)
-    if pressed_key[pg.K_PAGEDOWN]:
+    if keys[pg.K_PAGEDOWN]:
         app['draw_distance'] = max(500, app['draw_distance'] - 50)
     # Adjust world scale with + and -
-    if pressed_key[pg.K_EQUALS] or pressed_key[pg.K_KP_PLUS]:  # + key
+    if keys[pg.K_EQUALS] or keys[pg.K_KP_PLUS]:  # + key
         app['world_scale'] = min(WORLD_SCALE_MAX, app['world_scale'] + WORLD_SCALE_STEP)
-    if pressed_key[pg.K_MINUS] or pressed_key[pg.K_KP_MINUS]:  # - key
+    if keys[pg.K_MINUS] or keys[pg.K_KP_MINUS]:  # - key
         app['world_scale'] = max(WORLD_SCALE_MIN, app['world_scale'] - WORLD_SCALE_STEP)
 
     current_time = pg.time.get_ticks()
-    update_player(app['player'], mouse_rel, app['draw_distance'], app['chunk_manager'], app['dt'], app['world_scale'])
-    update_voxel_render(app['voxel_render'], app['player'], app['width'], app['height'], app['draw_distance'], current_time, app['world_scale'])
+    update_player(app['player'], keys, mouse_rel, current_time, app['draw_distance'], app['chunk_manager'],
+                  app['dt'], app['world_scale'])
+    update_voxel_render(app['voxel_render'], app['player'], app['width'], app['height'], app['draw_distance'], current_time, app['world_scale'],
+                        app['pixels'], app['pixels2d'])
 
 
 def draw_app(app):
-    draw_voxel_render(app['voxel_render'], app['screen'])
     pg.display.flip()
 
 